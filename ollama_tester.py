@@ -1,15 +1,99 @@
 import asyncio
-import os
-import statistics
-import threading
+import itertools
+import json
+import math
 import time
-from multiprocessing import Process
-from typing import Union
+from array import array
+from pathlib import Path
+from typing import Tuple, Union
 
 import httpx
+import numpy as np
+
+try:
+    import uvloop
+except ImportError:  # uvloop is optional and not available on Windows
+    uvloop = None
+
+# Characters in model names that are not safe in result file names.
+_FILENAME_TABLE = str.maketrans({"/": "_", ":": "_"})
+
+
+class Metrics:
+    """
+    Request counters and running response time statistics for one model.
+
+    Mean, min, max and standard deviation are folded in as responses arrive
+    using Welford's online algorithm. The raw response times are kept in a
+    compact array of doubles only for the percentiles.
+    """
+
+    __slots__ = (
+        "successful_requests",
+        "error_requests",
+        "canceled_requests",
+        "mean_response_time",
+        "min_response_time",
+        "max_response_time",
+        "response_times",
+        "_m2",
+    )
+
+    def __init__(self):
+        self.successful_requests = 0
+        self.error_requests = 0
+        self.canceled_requests = 0
+        self.mean_response_time = 0.0
+        self.min_response_time = math.inf
+        self.max_response_time = 0.0
+        self.response_times = array("d")
+        self._m2 = 0.0
+
+    def record_success(self, elapsed: float) -> None:
+        """
+        Count a successful request and update the response time statistics.
+
+        Args:
+            elapsed (float): Response time of the request in seconds.
+        """
+        self.successful_requests += 1
+        delta = elapsed - self.mean_response_time
+        self.mean_response_time += delta / self.successful_requests
+        self._m2 += delta * (elapsed - self.mean_response_time)
+        if elapsed < self.min_response_time:
+            self.min_response_time = elapsed
+        if elapsed > self.max_response_time:
+            self.max_response_time = elapsed
+        self.response_times.append(elapsed)
+
+    @property
+    def stdev_response_time(self) -> float:
+        """
+        float: Sample standard deviation of the response times.
+        """
+        if self.successful_requests < 2:
+            return 0.0
+        return math.sqrt(self._m2 / (self.successful_requests - 1))
+
+    def percentiles(self, *q: float) -> list:
+        """
+        Compute percentiles of the response times.
+
+        Args:
+            *q (float): Percentiles to compute, between 0 and 100.
+
+        Returns:
+            list: The response time in seconds for each requested percentile.
+        """
+        # Zero-copy view of the samples, so numpy works on the array in place.
+        times = np.frombuffer(self.response_times, dtype=np.float64)
+        return np.percentile(times, q).tolist()
 
 
 class TESTER:
+    # Hosts already probed by _verify_url, shared by all instances.
+    _verified_hosts = set()
+
     def __init__(
         self,
         api_requests: dict,
@@ -20,6 +104,7 @@ class TESTER:
         method: str = "POST",
         url: str = "10.204.16.75",
         save_path: str = "./result",
+        http2: bool = False,
     ):
         """
         Initialize the TESTER class for performing API stress tests.
@@ -33,6 +118,10 @@ class TESTER:
             method (str): HTTP method to be used (e.g., 'POST'). Default is 'POST'.
             url (str): Base URL for the API requests.
             save_path (str): Directory path to save the results.
+            http2 (bool): Multiplex requests over HTTP/2 instead of using HTTP/1.1.
+                The endpoint is plain HTTP, so this uses HTTP/2 prior knowledge and
+                the server (or a proxy in front of Ollama) must accept it. Requires
+                `httpx[http2]`. Default is False.
         """
         self.virtual_user = virtual_user
         self.http_timeout = http_timeout
@@ -41,11 +130,34 @@ class TESTER:
         self.method = method
         self.api_requests = api_requests
         self.save_path = self._verify_save_path(save_path)
+        self._result_paths = {
+            model_name: self.save_path.joinpath(
+                f"api_metrics_{model_name.translate(_FILENAME_TABLE)}.txt"
+            )
+            for model_name in api_requests
+        }
+        # Settings for the pooled client each run shares across every model, so
+        # connections are kept alive and reused instead of re-established per model.
+        max_in_flight = virtual_user * max(len(api_requests), 1)
+        self._client_options = {
+            "limits": httpx.Limits(
+                max_connections=max_in_flight,
+                max_keepalive_connections=max_in_flight,
+            ),
+            "timeout": http_timeout,
+            "headers": {"Content-Type": "application/json"},
+            "http1": not http2,
+            "http2": http2,
+        }
 
-    def _verify_url(self, url: str, port: int) -> str:
+    @classmethod
+    def _verify_url(cls, url: str, port: int) -> str:
         """
         Verify if the URL is reachable and return the formatted URL.
 
+        Each host is probed only once per process; later testers targeting the
+        same host skip the check.
+
         Args:
             url (str): The base URL.
             port (int): The port number to be used.
@@ -54,17 +166,22 @@ class TESTER:
             str: The formatted URL with the specified port.
         """
         test_ollama = f"http://{url}:{port}"
+        chat_url = f"http://{url}:{port}/api/chat"
+        if test_ollama in cls._verified_hosts:
+            return chat_url
+        cls._verified_hosts.add(test_ollama)
+
         try:
-            response = httpx.get(test_ollama, timeout=10)
+            response = httpx.head(test_ollama, timeout=2)
             if response.status_code == 200:
                 print(f"URL {test_ollama} is reachable.")
             else:
                 print(f"URL {test_ollama} returned status code {response.status_code}.")
         except httpx.RequestError as e:
             print(f"An error occurred: {e}")
-        return f"http://{url}:{port}/api/chat"
+        return chat_url
 
-    def _verify_save_path(self, path: str) -> str:
+    def _verify_save_path(self, path: str) -> Path:
         """
         Verify if the save path exists, and create it if it does not.
 
@@ -72,145 +189,161 @@ class TESTER:
             path (str): The directory path to save the results.
 
         Returns:
-            str: The verified save path.
+            Path: The verified save path.
         """
-        if not os.path.isdir(path):
-            os.makedirs(path)
-        return path
+        save_path = Path(path)
+        save_path.mkdir(parents=True, exist_ok=True)
+        return save_path
 
     async def chat_stream(
-        self, client: httpx.AsyncClient, request_data: dict
-    ) -> Union[httpx.Response, None]:
+        self, client: httpx.AsyncClient, request_body: bytes
+    ) -> Tuple[Union[int, None], float]:
         """
         Perform an asynchronous HTTP request to the chat API.
 
         Args:
             client (httpx.AsyncClient): The HTTP client to be used for the request.
-            request_data (dict): The data to be sent in the request.
+            request_body (bytes): The JSON encoded payload to be sent in the request.
 
         Returns:
-            Union[httpx.Response, None]: The response object if successful, otherwise None.
+            Tuple[Union[int, None], float]: The HTTP status code and the response
+                time in seconds, or (None, 0.0) if the request failed.
         """
+        start = time.perf_counter()
         try:
-            response = await client.request(
-                self.method,
-                self.url,
-                json=request_data,
-                timeout=self.http_timeout,
-            )
-            if response.status_code == 200:
-                pass
-            return response
-        except httpx.RequestError as e:
-            if isinstance(e, httpx.TimeoutException):
-                pass
-            else:
-                pass
-            return None
+            # Timeout and JSON content type are set once on the shared client.
+            response = await client.request(self.method, self.url, content=request_body)
+        except httpx.RequestError:
+            return None, 0.0
+        return response.status_code, time.perf_counter() - start
+
+    def process_response(
+        self, result: Tuple[Union[int, None], float], metrics: Metrics
+    ) -> None:
+        """
+        Process the result of a completed request and update the metrics.
 
-    async def process_response(self, task, metrics: dict) -> None:
+        Args:
+            result (Tuple[Union[int, None], float]): The status code and response
+                time returned by chat_stream.
+            metrics (Metrics): Metrics of the model being tested.
         """
-        Process the response from an asynchronous task and update the metrics.
+        status, elapsed = result
+        if status == 200:
+            metrics.record_success(elapsed)
+        elif status is None:
+            metrics.canceled_requests += 1
+        else:
+            metrics.error_requests += 1
+
+    async def _bounded_chat(
+        self,
+        sem: asyncio.Semaphore,
+        client: httpx.AsyncClient,
+        request_body: bytes,
+        metrics: Metrics,
+    ) -> None:
+        """
+        Send one request in an already acquired user slot and record the outcome.
 
         Args:
-            task: The asyncio task to be processed.
-            metrics (dict): Dictionary to store metrics such as successful requests, errors, etc.
+            sem (asyncio.Semaphore): Semaphore holding the slot, released when done.
+            client (httpx.AsyncClient): The HTTP client to be used for the request.
+            request_body (bytes): The JSON encoded payload to be sent in the request.
+            metrics (Metrics): Metrics of the model being tested.
         """
         try:
-            result = await task
-            if isinstance(result, httpx.Response) and result.status_code == 200:
-                metrics["successful_requests"] += 1
-                metrics["response_times"].append(result.elapsed.total_seconds())
-            elif isinstance(result, httpx.Response):
-                metrics["error_requests"] += 1
-            elif result is None:
-                metrics["canceled_requests"] += 1
-            else:
-                metrics["error_requests"] += 1
-        except asyncio.CancelledError:
-            metrics["canceled_requests"] += 1
+            result = await self.chat_stream(client, request_body)
         except Exception as e:
             print(f"Unexpected error occurred: {str(e)}")
-            metrics["error_requests"] += 1
+            metrics.error_requests += 1
+        else:
+            self.process_response(result, metrics)
+        finally:
+            sem.release()
 
     async def make_requests(
-        self, payload: list, duration: int, users: int, stop_event: threading.Event
+        self,
+        client: httpx.AsyncClient,
+        payload: list,
+        duration: int,
+        users: int,
     ) -> dict:
         """
         Make concurrent requests to the API for the given duration and track metrics.
 
         Args:
+            client (httpx.AsyncClient): The shared HTTP client to send requests with.
             payload (list): List of request payloads to be sent.
             duration (int): Duration for which the requests should be made.
             users (int): Number of concurrent users to simulate.
-            stop_event (threading.Event): Event to signal stopping the requests.
 
         Returns:
             dict: Dictionary containing metrics for the requests.
         """
-        start_time = time.time()
-        end_time = start_time + duration
-        metrics = {
-            "successful_requests": 0,
-            "error_requests": 0,
-            "canceled_requests": 0,
-            "response_times": [],
-        }
-        tasks = []
-
-        async with httpx.AsyncClient() as client:
-            while not stop_event.is_set() and time.time() < end_time:
-                for p in payload:
-                    if len(tasks) >= users:
-                        # Wait for any of the tasks to complete if we've reached the user limit
-                        done, pending = await asyncio.wait(
-                            tasks, return_when=asyncio.FIRST_COMPLETED
-                        )
-                        tasks = list(pending)
-                        for task in done:
-                            asyncio.create_task(self.process_response(task, metrics))
-                    # Submit new requests
-                    tasks.append(asyncio.create_task(self.chat_stream(client, p)))
-                await asyncio.sleep(0.1)
-
-            # Cancel all pending tasks when the time is up
-            for task in tasks:
-                if not task.done():
-                    task.cancel()
-                    metrics["canceled_requests"] += 1
-
-            # Wait for remaining tasks to complete
-            done, _ = await asyncio.wait(tasks, return_when=asyncio.ALL_COMPLETED)
-            for task in done:
-                if not task.cancelled():
-                    await self.process_response(task, metrics)
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        deadline = start_time + duration
+        metrics = Metrics()
+        # The payloads never change during a test, so encode them only once.
+        bodies = [json.dumps(p, separators=(",", ":")).encode() for p in payload]
+        sem = asyncio.Semaphore(users)
+        tasks = set()
+
+        async def dispatch():
+            # No fixed pacing: the semaphore blocks until a virtual user is free.
+            for body in itertools.cycle(bodies):
+                # Wait for a free slot if every virtual user has a request in flight
+                await sem.acquire()
+                # Requests that complete without suspending (e.g. eager tasks on
+                # Python 3.12+) free their slot at once, so acquire() may never
+                # yield and the wait_for timer below would never fire.
+                if loop.time() >= deadline:
+                    sem.release()
+                    break
+                task = asyncio.create_task(
+                    self._bounded_chat(sem, client, body, metrics)
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+        # The timeout ends dispatching at the deadline while it is waiting for a
+        # free slot.
+        try:
+            await asyncio.wait_for(dispatch(), timeout=duration)
+        except asyncio.TimeoutError:
+            pass
+
+        # Cancel all pending tasks when the time is up and wait for them to unwind;
+        # finished requests have already been recorded by _bounded_chat.
+        for task in tasks:
+            if task.cancel():
+                metrics.canceled_requests += 1
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Actual test time, including the short shutdown after the deadline.
+        elapsed_time = loop.time() - start_time
 
         total_requests = (
-            metrics["successful_requests"]
-            + metrics["error_requests"]
-            + metrics["canceled_requests"]
+            metrics.successful_requests
+            + metrics.error_requests
+            + metrics.canceled_requests
         )
 
         requests_per_sec = (
-            metrics["successful_requests"] / self.test_duration
-            if metrics["response_times"]
-            else 0
-        )
-        avg_response_time = (
-            statistics.mean(metrics["response_times"])
-            if metrics["response_times"]
-            else 0
-        )
-        min_response_time = (
-            min(metrics["response_times"]) if metrics["response_times"] else 0
-        )
-        max_response_time = (
-            max(metrics["response_times"]) if metrics["response_times"] else 0
+            metrics.successful_requests / elapsed_time if elapsed_time > 0 else 0
         )
+        if metrics.successful_requests:
+            avg_response_time = metrics.mean_response_time
+            min_response_time = metrics.min_response_time
+            max_response_time = metrics.max_response_time
+            stdev_response_time = metrics.stdev_response_time
+            p50, p95, p99 = metrics.percentiles(50, 95, 99)
+        else:
+            avg_response_time = stdev_response_time = 0
+            min_response_time = max_response_time = 0
+            p50 = p95 = p99 = 0
         error_percentage = (
-            (metrics["error_requests"] / total_requests * 100)
-            if total_requests > 0
-            else 0
+            (metrics.error_requests / total_requests * 100) if total_requests > 0 else 0
         )
 
         return {
@@ -219,57 +352,98 @@ class TESTER:
             "avg_response_time": avg_response_time,
             "min_response_time": min_response_time,
             "max_response_time": max_response_time,
+            "stdev_response_time": stdev_response_time,
+            "p50_response_time": p50,
+            "p95_response_time": p95,
+            "p99_response_time": p99,
             "error_percentage": error_percentage,
-            "canceled_requests": metrics["canceled_requests"],
+            "canceled_requests": metrics.canceled_requests,
         }
 
+    def _format_report(self, model_name: str, metrics: dict) -> str:
+        """
+        Build the text report saved for one model.
+
+        Args:
+            model_name (str): Name of the tested model.
+            metrics (dict): Summary metrics returned by make_requests.
+
+        Returns:
+            str: The complete report, written to the result file in one call.
+        """
+        return (
+            f"Model: {model_name}\n"
+            f"Total requests sent: {metrics['total_requests_sent']}\n"
+            f"Requests/s: {metrics['requests_per_second']:.2f}\n"
+            f"Avg. response time (s): {metrics['avg_response_time']:.2f}\n"
+            f"Min(s): {metrics['min_response_time']:.2f}\n"
+            f"Max(s): {metrics['max_response_time']:.2f}\n"
+            f"Std. dev. (s): {metrics['stdev_response_time']:.2f}\n"
+            f"P50(s): {metrics['p50_response_time']:.2f}\n"
+            f"P95(s): {metrics['p95_response_time']:.2f}\n"
+            f"P99(s): {metrics['p99_response_time']:.2f}\n"
+            f"Error %: {metrics['error_percentage']:.2f}%\n"
+            f"Canceled requests: {metrics['canceled_requests']}\n"
+            "\n"
+        )
+
     def run(self) -> None:
         """
         Run the API stress tests and collect metrics.
         """
         all_metrics = {}
-        stop_event = threading.Event()
 
         async def run_tests():
-            tasks = []
-            for model, payload in self.api_requests.items():
-                tasks.append(
-                    self.make_requests(
-                        payload, self.test_duration, self.virtual_user, stop_event
+            # Python 3.12+: start tasks eagerly so coroutines that finish without
+            # suspending never go through the scheduler.
+            if hasattr(asyncio, "eager_task_factory"):
+                asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+
+            async with httpx.AsyncClient(**self._client_options) as client:
+                tasks = []
+                for model, payload in self.api_requests.items():
+                    tasks.append(
+                        self.make_requests(
+                            client,
+                            payload,
+                            self.test_duration,
+                            self.virtual_user,
+                        )
                     )
-                )
-            results = await asyncio.gather(*tasks)
-            stop_event.set()
+                # A failing model must not discard the results of the others.
+                results = await asyncio.gather(*tasks, return_exceptions=True)
 
             for model, metrics in zip(self.api_requests.keys(), results):
+                if isinstance(metrics, BaseException):
+                    print(f"Test for model {model} failed: {metrics!r}")
+                    continue
                 all_metrics[model] = metrics
                 print(all_metrics[model])
 
             # Save results to file
             print("Saving result...")
             for model_name, metrics in all_metrics.items():
-                with open(
-                    os.path.join(
-                        self.save_path,
-                        f"api_metrics_{model_name.replace('/', '_').replace(':', '_')}.txt",
-                    ),
-                    "w",
-                ) as f:
-                    f.write(f"Model: {model_name}\n")
-                    f.write(f"Total requests sent: {metrics['total_requests_sent']}\n")
-                    f.write(f"Requests/s: {metrics['requests_per_second']:.2f}\n")
-                    f.write(
-                        f"Avg. response time (s): {metrics['avg_response_time']:.2f}\n"
-                    )
-                    f.write(f"Min(s): {metrics['min_response_time']:.2f}\n")
-                    f.write(f"Max(s): {metrics['max_response_time']:.2f}\n")
-                    f.write(f"Error %: {metrics['error_percentage']:.2f}%\n")
-                    f.write(f"Canceled requests: {metrics['canceled_requests']}\n")
-                    f.write("\n")
+                self._result_paths[model_name].write_text(
+                    self._format_report(model_name, metrics)
+                )
 
             print("End")
 
-        asyncio.run(run_tests())
+        # Run on a uvloop loop without changing the global event loop policy.
+        # uvloop.run() needs uvloop >= 0.18; older releases use asyncio.Runner
+        # (Python 3.11+) with a uvloop loop factory instead.
+        if uvloop is not None and hasattr(uvloop, "run"):
+            uvloop.run(run_tests())
+        elif uvloop is not None and hasattr(asyncio, "Runner"):
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                runner.run(run_tests())
+        else:
+            if uvloop is not None:
+                print(
+                    "uvloop is installed but needs uvloop >= 0.18 or Python 3.11+ "
+                    "to be used; running on the default asyncio event loop."
+                )
+            asyncio.run(run_tests())
 
 
 def run_tester(
@@ -338,20 +512,11 @@ if __name__ == "__main__":
         ],
     }
 
-    processes = []
-    for model_name, request_payload in api_requests.items():
-        p = Process(
-            target=run_tester,
-            args=(
-                {model_name: request_payload},
-                "172.17.0.3",
-                600,
-                60,
-                20,
-            ),
-        )
-        processes.append(p)
-        p.start()
-
-    for p in processes:
-        p.join()
+    # All models share one event loop and one connection pool.
+    run_tester(
+        api_requests=api_requests,
+        url="172.17.0.3",
+        test_duration=600,
+        http_timeout=60,
+        virtual_user=20,
+    )
@@ -0,0 +1,43 @@
+import tempfile
+import threading
+import time
+import unittest
+
+import httpx
+
+from ollama_tester import TESTER
+
+
+class RunDurationTest(unittest.TestCase):
+    def test_run_stops_at_deadline_with_instant_responses(self):
+        """
+        run() must return after about test_duration even when every request
+        completes without suspending (eager tasks on Python 3.12+).
+        """
+        test_duration = 2
+        with tempfile.TemporaryDirectory() as save_path:
+            tester = TESTER(
+                api_requests={"mock:latest": [{"model": "mock:latest"}]},
+                test_duration=test_duration,
+                virtual_user=4,
+                url="127.0.0.1",
+                port=1,
+                save_path=save_path,
+            )
+            tester._client_options["transport"] = httpx.MockTransport(
+                lambda request: httpx.Response(200)
+            )
+
+            # Run in a daemon thread so a hang fails the test instead of blocking it.
+            runner = threading.Thread(target=tester.run, daemon=True)
+            start = time.monotonic()
+            runner.start()
+            runner.join(timeout=test_duration + 10)
+            elapsed = time.monotonic() - start
+
+        self.assertFalse(runner.is_alive(), "run() did not return")
+        self.assertLess(elapsed, test_duration + 5)
+
+
+if __name__ == "__main__":
+    unittest.main()